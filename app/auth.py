@@ -8,7 +8,7 @@ import secrets
 import logging
 from datetime import datetime, timedelta
 from typing import Optional
-from functools import wraps
+from functools import cache, wraps
 
 from fastapi import Request, Response, HTTPException
 from fastapi.responses import RedirectResponse
@@ -141,8 +141,12 @@ def require_auth_api(func):
     return wrapper
 
 
+@cache
 def is_auth_enabled() -> bool:
-    """Check if authentication is enabled (password hash is set)."""
+    """
+    Check if authentication is enabled (password hash is set).
+    Settings are fixed for the process lifetime, so the result is cached.
+    """
     return bool(settings.ADMIN_PASSWORD_HASH)
 
 
@@ -186,8 +186,8 @@ async def backup_task():
                 # Upload to backup MinIO
                 success = await upload_backup_to_minio(backup_client, backup_path)
                 
-                # Cleanup local file
-                os.remove(backup_path)
+                # Cleanup local file (off the event loop)
+                await asyncio.to_thread(os.remove, backup_path)
                 
                 if success:
                     # Cleanup old backups
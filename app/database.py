@@ -6,7 +6,7 @@ Includes custom PostgresSession for Telethon.
 """
 import logging
 from datetime import datetime
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Set, AsyncIterator
 
 import asyncpg
 from telethon.sessions import MemorySession
@@ -82,10 +82,13 @@ class PostgresSession(MemorySession):
 async def create_db_pool() -> asyncpg.Pool:
     """Create and return a connection pool."""
     dsn = settings.DATABASE_URL
+    # Each concurrent channel scan holds one connection for its duration,
+    # so keep enough warm connections for the scanners plus request traffic
     pool = await asyncpg.create_pool(
         dsn,
-        min_size=2,
-        max_size=10,
+        min_size=max(4, settings.MAX_CONCURRENT_SCANS + 2),
+        max_size=settings.DB_POOL_MAX_SIZE,
+        max_inactive_connection_lifetime=300,
         command_timeout=60
     )
     logger.info("Database pool created")
@@ -179,6 +182,7 @@ async def init_database(pool: asyncpg.Pool):
         indexes = [
             "CREATE INDEX IF NOT EXISTS idx_files_status ON files(status)",
             "CREATE INDEX IF NOT EXISTS idx_files_status_created ON files(status, created_at DESC)",
+            "CREATE INDEX IF NOT EXISTS idx_files_status_updated_id ON files(status, updated_at DESC, id DESC)",
             "CREATE INDEX IF NOT EXISTS idx_files_processing_status ON files(processing_status)",
             "CREATE INDEX IF NOT EXISTS idx_files_content_hash ON files(content_hash)",
             "CREATE INDEX IF NOT EXISTS idx_files_channel_id ON files(channel_id)",
@@ -224,6 +228,70 @@ async def insert_file(pool: asyncpg.Pool, data: Dict[str, Any]) -> Optional[int]
         return None
 
 
+async def insert_files_bulk(
+    conn: asyncpg.Connection,
+    files: List[tuple],
+    channel_id: Optional[int] = None,
+    watermark: Optional[int] = None
+) -> List[int]:
+    """
+    Insert many file records in one statement. Returns IDs of new rows.
+    
+    Each record is a (channel_id, message_id, file_name, file_size,
+    file_type, mime_type, destination_category) tuple; records are
+    transposed into one array per UNNEST column.
+    
+    If watermark is given, the channel's last_scanned_message_id is advanced
+    to it in the same transaction, so inserts and watermark commit together.
+    """
+    if not files and watermark is None:
+        return []
+    try:
+        async with conn.transaction():
+            file_ids = []
+            if files:
+                rows = await conn.fetch("""
+                    INSERT INTO files (channel_id, message_id, file_name, file_size, file_type,
+                                       mime_type, destination_category)
+                    SELECT * FROM UNNEST(
+                        $1::bigint[], $2::bigint[], $3::varchar[], $4::bigint[],
+                        $5::varchar[], $6::varchar[], $7::varchar[]
+                    )
+                    ON CONFLICT (channel_id, message_id) DO NOTHING
+                    RETURNING id
+                """, *zip(*files))
+                file_ids = [r['id'] for r in rows]
+            
+            if watermark is not None:
+                await conn.execute("""
+                    UPDATE channels SET last_scanned_message_id = $2, updated_at = NOW()
+                    WHERE id = $1 AND last_scanned_message_id < $2
+                """, channel_id, watermark)
+            
+            return file_ids
+    except Exception as e:
+        logger.error(f"Failed to insert {len(files)} files: {e}")
+        return []
+
+
+def _split_total(rows) -> tuple[List[Dict], int]:
+    """
+    Split rows selected with COUNT(*) OVER() AS _total into (files, total).
+    An empty page reports a total of 0; callers past page 1 must count
+    separately.
+    """
+    if not rows:
+        return [], 0
+    
+    total = rows[0]['_total']
+    files = []
+    for r in rows:
+        file = dict(r)
+        del file['_total']
+        files.append(file)
+    return files, total
+
+
 async def get_file_by_id(pool: asyncpg.Pool, file_id: int) -> Optional[Dict]:
     """Get a file by ID with channel info."""
     row = await pool.fetchrow("""
@@ -235,6 +303,17 @@ async def get_file_by_id(pool: asyncpg.Pool, file_id: int) -> Optional[Dict]:
     return dict(row) if row else None
 
 
+async def get_files_by_ids(pool: asyncpg.Pool, file_ids: List[int]) -> List[Dict]:
+    """Get the id, type and category of several files in one query."""
+    rows = await pool.fetch("""
+        SELECT id, file_type, destination_category
+        FROM files
+        WHERE id = ANY($1::int[])
+        ORDER BY id
+    """, file_ids)
+    return [dict(r) for r in rows]
+
+
 async def get_files_by_status(
     pool: asyncpg.Pool, 
     status: str,
@@ -253,15 +332,10 @@ async def get_files_by_status(
     
     offset = (page - 1) * per_page
     
-    # Get total count
-    total = await pool.fetchval(
-        "SELECT COUNT(*) FROM files WHERE status = $1",
-        status
-    )
-    
-    # Get paginated results
+    # Get paginated results with the total count folded in
     rows = await pool.fetch(f"""
-        SELECT f.*, c.name as channel_name, c.username as channel_username
+        SELECT f.*, c.name as channel_name, c.username as channel_username,
+               COUNT(*) OVER() AS _total
         FROM files f
         LEFT JOIN channels c ON f.channel_id = c.id
         WHERE f.status = $1
@@ -269,7 +343,13 @@ async def get_files_by_status(
         LIMIT $2 OFFSET $3
     """, status, per_page, offset)
     
-    return [dict(r) for r in rows], total
+    files, total = _split_total(rows)
+    if not files and page > 1:
+        # Past the last page the window count has no row to ride on
+        total = await pool.fetchval(
+            "SELECT COUNT(*) FROM files WHERE status = $1", status
+        )
+    return files, total
 
 
 async def get_active_files(pool: asyncpg.Pool) -> List[Dict]:
@@ -286,12 +366,16 @@ async def get_active_files(pool: asyncpg.Pool) -> List[Dict]:
 
 async def get_history_files(
     pool: asyncpg.Pool,
-    page: int = 1,
-    per_page: int = 50
-) -> tuple[List[Dict], List[Dict], int]:
-    """Get completed and failed files for history view."""
-    offset = (page - 1) * per_page
+    per_page: int = 50,
+    before: Optional[tuple[datetime, int]] = None
+) -> tuple[List[Dict], List[Dict], bool]:
+    """
+    Get completed and failed files for history view.
     
+    Completed files use keyset pagination on (updated_at, id): pass the
+    last row's key as `before` to get the next page. Returns
+    (failed, completed, has_more).
+    """
     # Failed files (always show all)
     failed_rows = await pool.fetch("""
         SELECT f.*, c.name as channel_name, c.username as channel_username
@@ -301,22 +385,31 @@ async def get_history_files(
         ORDER BY f.updated_at DESC
     """)
     
-    # Completed files (paginated)
-    completed_rows = await pool.fetch("""
-        SELECT f.*, c.name as channel_name, c.username as channel_username
-        FROM files f
-        LEFT JOIN channels c ON f.channel_id = c.id
-        WHERE f.status = 'COMPLETED'
-        ORDER BY f.updated_at DESC
-        LIMIT $1 OFFSET $2
-    """, per_page, offset)
+    # Completed files (one extra row tells us whether there is a next page)
+    if before:
+        completed_rows = await pool.fetch("""
+            SELECT f.*, c.name as channel_name, c.username as channel_username
+            FROM files f
+            LEFT JOIN channels c ON f.channel_id = c.id
+            WHERE f.status = 'COMPLETED'
+            AND (f.updated_at, f.id) < ($2, $3)
+            ORDER BY f.updated_at DESC, f.id DESC
+            LIMIT $1
+        """, per_page + 1, before[0], before[1])
+    else:
+        completed_rows = await pool.fetch("""
+            SELECT f.*, c.name as channel_name, c.username as channel_username
+            FROM files f
+            LEFT JOIN channels c ON f.channel_id = c.id
+            WHERE f.status = 'COMPLETED'
+            ORDER BY f.updated_at DESC, f.id DESC
+            LIMIT $1
+        """, per_page + 1)
     
-    # Total completed
-    total = await pool.fetchval(
-        "SELECT COUNT(*) FROM files WHERE status = 'COMPLETED'"
-    )
+    has_more = len(completed_rows) > per_page
+    completed = [dict(r) for r in completed_rows[:per_page]]
     
-    return [dict(r) for r in failed_rows], [dict(r) for r in completed_rows], total
+    return [dict(r) for r in failed_rows], completed, has_more
 
 
 async def update_file_status(
@@ -347,6 +440,30 @@ async def update_file_status(
         return False
 
 
+async def claim_queued_file(pool: asyncpg.Pool, file_id: int) -> Optional[Dict]:
+    """
+    Atomically move a QUEUED file to DOWNLOADING and return it with channel info.
+    Returns None if the file is gone, no longer QUEUED, or locked by another
+    worker (SKIP LOCKED), so a file is never processed twice.
+    """
+    row = await pool.fetchrow("""
+        WITH claimed AS (
+            UPDATE files
+            SET status = 'DOWNLOADING', updated_at = NOW()
+            WHERE id = (
+                SELECT id FROM files
+                WHERE id = $1 AND status = 'QUEUED'
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING *
+        )
+        SELECT claimed.*, c.name as channel_name, c.username as channel_username
+        FROM claimed
+        LEFT JOIN channels c ON claimed.channel_id = c.id
+    """, file_id)
+    return dict(row) if row else None
+
+
 async def increment_retry_count(pool: asyncpg.Pool, file_id: int) -> int:
     """Increment retry count and return new value."""
     row = await pool.fetchrow("""
@@ -371,6 +488,25 @@ async def update_file_category(pool: asyncpg.Pool, file_id: int, category: str)
         return False
 
 
+async def bulk_approve_files(
+    pool: asyncpg.Pool,
+    file_ids: List[int],
+    category: str,
+    status: str
+) -> List[int]:
+    """
+    Set category and status for many PENDING files at once.
+    Returns the IDs actually updated; missing IDs were not found or not pending.
+    """
+    rows = await pool.fetch("""
+        UPDATE files
+        SET destination_category = $2, status = $3, updated_at = NOW()
+        WHERE id = ANY($1::int[]) AND status = 'PENDING'
+        RETURNING id
+    """, file_ids, category, status)
+    return [r['id'] for r in rows]
+
+
 async def mark_file_processed(pool: asyncpg.Pool, file_id: int, data: Dict) -> bool:
     """Mark file as processed by n8n."""
     try:
@@ -417,16 +553,44 @@ async def check_content_hash_exists(pool: asyncpg.Pool, content_hash: str) -> Op
     return row['id'] if row else None
 
 
+async def get_content_hashes(pool: asyncpg.Pool) -> Set[str]:
+    """Get every recorded content hash (seeds the worker's in-memory dedup filter)."""
+    rows = await pool.fetch(
+        "SELECT DISTINCT content_hash FROM files WHERE content_hash IS NOT NULL"
+    )
+    return {r['content_hash'] for r in rows}
+
+
 # =============================================================================
 # Queue Recovery
 # =============================================================================
 
-async def get_queued_file_ids(pool: asyncpg.Pool) -> List[int]:
-    """Get IDs of files with QUEUED status for queue recovery on restart."""
-    rows = await pool.fetch(
-        "SELECT id FROM files WHERE status = 'QUEUED' ORDER BY updated_at ASC"
-    )
-    return [r['id'] for r in rows]
+async def get_queued_file_ids(
+    pool: asyncpg.Pool,
+    batch_size: int = 500
+) -> AsyncIterator[int]:
+    """
+    Stream IDs of files with QUEUED status for queue recovery on restart.
+    Reads keyset batches by id, so callers can start on the first IDs
+    before the rest are read, and no connection or transaction is held
+    while they do.
+    """
+    last_id = 0
+    while True:
+        rows = await pool.fetch(
+            """
+            SELECT id FROM files
+            WHERE status = 'QUEUED' AND id > $1
+            ORDER BY id
+            LIMIT $2
+            """,
+            last_id, batch_size
+        )
+        for row in rows:
+            yield row['id']
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1]['id']
 
 
 async def reset_downloading_files(pool: asyncpg.Pool) -> int:
@@ -490,10 +654,10 @@ async def get_channel_by_id(pool: asyncpg.Pool, channel_id: int) -> Optional[Dic
     return dict(row) if row else None
 
 
-async def insert_channel(pool: asyncpg.Pool, data: Dict) -> bool:
-    """Insert or update a channel."""
+async def insert_channel(pool: asyncpg.Pool, data: Dict) -> Optional[Dict]:
+    """Insert or update a channel. Returns the stored row, or None on failure."""
     try:
-        await pool.execute("""
+        row = await pool.fetchrow("""
             INSERT INTO channels (id, name, username)
             VALUES ($1, $2, $3)
             ON CONFLICT (id) DO UPDATE SET
@@ -501,19 +665,12 @@ async def insert_channel(pool: asyncpg.Pool, data: Dict) -> bool:
                 username = EXCLUDED.username,
                 is_active = true,
                 updated_at = NOW()
+            RETURNING *
         """, data['id'], data.get('name'), data.get('username'))
-        return True
+        return dict(row) if row else None
     except Exception as e:
         logger.error(f"Failed to insert channel: {e}")
-        return False
-
-
-async def update_channel_last_scanned(pool: asyncpg.Pool, channel_id: int, message_id: int):
-    """Update the last scanned message ID for a channel."""
-    await pool.execute("""
-        UPDATE channels SET last_scanned_message_id = $2, updated_at = NOW()
-        WHERE id = $1
-    """, channel_id, message_id)
+        return None
 
 
 async def deactivate_channel(pool: asyncpg.Pool, channel_id: int) -> bool:
@@ -20,9 +20,10 @@ logger = logging.getLogger(__name__)
 async def check_file_exists_in_minio(minio_client, bucket: str, object_path: str) -> bool:
     """
     Check if an object exists in MinIO.
+    The blocking minio-py call runs in a worker thread.
     """
     try:
-        minio_client.stat_object(bucket, object_path)
+        await asyncio.to_thread(minio_client.stat_object, bucket, object_path)
         return True
     except Exception:
         return False
@@ -10,15 +10,15 @@ from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
 from fastapi.responses import JSONResponse
 from minio import Minio
 from telethon import TelegramClient
 
 from .config import settings, ALL_BUCKETS, CATEGORIES
-from .database import create_db_pool, init_database, PostgresSession
-from .worker import download_worker, recover_queue
-from .scanner import channel_scanner
+from .database import create_db_pool, init_database, get_content_hashes, PostgresSession
+from .minio_client import check_minio_connection
+from .worker import download_worker, recover_queue, cancel_requeues, close_http_client
+from .scanner import channel_scanner, register_new_message_handler
 from .healing import self_healing_task
 from .backup import backup_task
 from .routes import dashboard, channels, files, auth
@@ -79,7 +79,7 @@ async def lifespan(app: FastAPI):
     # Initialize MinIO
     logger.info("Connecting to MinIO...")
     app.state.minio_client = create_minio_client()
-    ensure_buckets_exist(app.state.minio_client)
+    await asyncio.to_thread(ensure_buckets_exist, app.state.minio_client)
     
     # Initialize Telegram client with PostgresSession
     logger.info("Initializing Telegram client...")
@@ -100,9 +100,18 @@ async def lifespan(app: FastAPI):
         'authenticated': await app.state.telegram_client.is_user_authorized()
     }
     
+    # Active channel list, loaded lazily by the channel routes
+    app.state.channels_cache = None
+    
     # Initialize download queue
     app.state.download_queue = asyncio.Queue(maxsize=1000)
     
+    # File IDs queued or being processed (prevents duplicate downloads)
+    app.state.in_flight = set()
+    
+    # Set by the worker when an upload completes (n8n long-poll)
+    app.state.new_file_event = asyncio.Event()
+    
     # List to track background tasks
     app.state.background_tasks = []
     
@@ -123,25 +132,46 @@ async def lifespan(app: FastAPI):
         except Exception as e:
             logger.warning(f"Failed to warm up entity cache: {e}")
         
-        # Recover queue from database
-        await recover_queue(app.state.db_pool, app.state.download_queue)
+        # Content hashes already stored (skips most duplicate lookups).
+        # Without it workers query the database for every file instead.
+        app.state.known_hashes = None
+        if settings.ENABLE_CONTENT_DEDUP:
+            try:
+                app.state.known_hashes = await get_content_hashes(app.state.db_pool)
+            except Exception as e:
+                logger.warning(f"Failed to load content hashes: {e}")
         
-        # Start channel scanner
+        # Discover new files from Telegram updates as they arrive
+        await register_new_message_handler(app.state.telegram_client, app.state.db_pool)
+        
+        # Start channel scanner (reconciliation sweep)
         scanner_task = asyncio.create_task(
             channel_scanner(app.state.telegram_client, app.state.db_pool)
         )
         app.state.background_tasks.append(scanner_task)
         
-        # Start download worker
-        worker_task = asyncio.create_task(
-            download_worker(
-                app.state.telegram_client,
-                app.state.minio_client,
-                app.state.db_pool,
-                app.state.download_queue
+        # Start download workers (all consume the same queue)
+        for _ in range(settings.DOWNLOAD_CONCURRENCY):
+            worker_task = asyncio.create_task(
+                download_worker(
+                    app.state.telegram_client,
+                    app.state.minio_client,
+                    app.state.db_pool,
+                    app.state.download_queue,
+                    app.state.in_flight,
+                    app.state.new_file_event,
+                    app.state.known_hashes
+                )
+            )
+            app.state.background_tasks.append(worker_task)
+        
+        # Recover queue from database (streams into the running workers)
+        recovery_task = asyncio.create_task(
+            recover_queue(
+                app.state.db_pool, app.state.download_queue, app.state.in_flight
             )
         )
-        app.state.background_tasks.append(worker_task)
+        app.state.background_tasks.append(recovery_task)
         
         # Start self-healing task
         healing_task = asyncio.create_task(
@@ -177,6 +207,15 @@ async def lifespan(app: FastAPI):
             await task
         except asyncio.CancelledError:
             pass
+        except Exception as e:
+            # A task that already died must not stop the rest of shutdown
+            logger.error(f"Background task failed: {e}")
+    
+    # Drop retries still waiting to re-queue (their rows stay QUEUED)
+    await cancel_requeues()
+    
+    # Close webhook HTTP client
+    await close_http_client()
     
     # Save Telegram session
     if hasattr(app.state.telegram_client.session, 'save_session'):
@@ -209,17 +248,28 @@ app.include_router(files.router)
 app.include_router(auth.router)
 
 
+async def _check_database(pool) -> bool:
+    """Probe the database with a trivial query."""
+    await pool.fetchval("SELECT 1")
+    return True
+
+
 @app.get("/health")
 async def health_check(request: Request):
     """Health check endpoint for Docker/Coolify."""
     try:
-        # Check database
-        db_ok = False
-        try:
-            await request.app.state.db_pool.fetchval("SELECT 1")
-            db_ok = True
-        except Exception:
-            pass
+        timeout = settings.HEALTH_CHECK_TIMEOUT
+        
+        # Check database and MinIO concurrently, each bounded by a timeout
+        # so a stuck backend cannot hang the health check itself
+        db_task = asyncio.create_task(asyncio.wait_for(
+            _check_database(request.app.state.db_pool),
+            timeout=timeout
+        ))
+        minio_task = asyncio.create_task(asyncio.wait_for(
+            asyncio.to_thread(check_minio_connection, request.app.state.minio_client),
+            timeout=timeout
+        ))
         
         # Check Telegram (verify session with server)
         tg_ok = False
@@ -236,13 +286,11 @@ async def health_check(request: Request):
         except Exception:
             tg_ok = False
         
-        # Check MinIO
-        minio_ok = False
-        try:
-            request.app.state.minio_client.list_buckets()
-            minio_ok = True
-        except Exception:
-            pass
+        db_ok, minio_ok = await asyncio.gather(
+            db_task, minio_task, return_exceptions=True
+        )
+        db_ok = db_ok is True
+        minio_ok = minio_ok is True
         
         status = "healthy" if (db_ok and minio_ok) else "degraded"
         
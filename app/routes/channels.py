@@ -4,34 +4,110 @@ TeleMinion V2 Channel Routes
 Channel management endpoints.
 """
 import logging
-from typing import Optional
+import time
+from typing import Dict, List, Optional
 
 from fastapi import APIRouter, Request, HTTPException, Form
 from fastapi.responses import HTMLResponse
-from fastapi.templating import Jinja2Templates
 from telethon.errors import UsernameNotOccupiedError, ChannelPrivateError
 
+from ..templating import templates
 from ..auth import require_auth
+from ..config import settings
 from ..database import (
     get_active_channels,
     get_channel_by_id,
     insert_channel,
-    deactivate_channel,
-    update_channel_last_scanned
+    deactivate_channel
 )
-from ..scanner import scan_channel
+from ..scanner import scan_channel, register_new_message_handler
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/channels", tags=["channels"])
-templates = Jinja2Templates(directory="templates")
+
+
+# Pre-encoded response fragments (skip str->bytes encoding per request)
+_NOT_CONNECTED_HTML = b"""
+            <div class="p-4 bg-red-500/20 border border-red-500/50 rounded-lg text-red-400">
+                <p>Telegram not connected. Please authenticate first.</p>
+            </div>
+        """
+_NOT_FOUND_HTML = b"""
+            <div class="p-4 bg-red-500/20 border border-red-500/50 rounded-lg text-red-400">
+                <p>Channel/username not found.</p>
+            </div>
+        """
+_PRIVATE_HTML = b"""
+            <div class="p-4 bg-red-500/20 border border-red-500/50 rounded-lg text-red-400">
+                <p>Channel is private. Join it first.</p>
+            </div>
+        """
+_SCAN_PREFIX = b"""
+            <div class="p-3 bg-green-500/20 border border-green-500/50 rounded text-green-400 text-sm">
+                Found """
+_FULL_SCAN_PREFIX = b"""
+            <div class="p-3 bg-green-500/20 border border-green-500/50 rounded text-green-400 text-sm">
+                Full scan complete: """
+_SCAN_SUFFIX = b""" new audio/PDF files
+            </div>
+        """
+_FULL_SCAN_SUFFIX = b""" audio/PDF files found
+            </div>
+        """
+
+
+# =============================================================================
+# Channel List Cache
+# =============================================================================
+
+def _channel_sort_key(channel: Dict):
+    """Match ORDER BY name (NULLs last)."""
+    name = channel.get('name')
+    return (name is None, name or '')
+
+
+async def get_cached_channels(request: Request) -> List[Dict]:
+    """
+    Get active channels from the in-memory cache.
+    Loads from the database lazily and again after CHANNELS_CACHE_TTL.
+    """
+    state = request.app.state
+    loaded_at = getattr(state, 'channels_cache_loaded_at', 0.0)
+    
+    if (getattr(state, 'channels_cache', None) is None
+            or time.monotonic() - loaded_at > settings.CHANNELS_CACHE_TTL):
+        state.channels_cache = await get_active_channels(state.db_pool)
+        state.channels_cache_loaded_at = time.monotonic()
+    
+    return state.channels_cache
+
+
+def cache_upsert_channel(request: Request, channel: Dict):
+    """Add or replace a channel in the cache (no-op if not loaded yet)."""
+    cache = getattr(request.app.state, 'channels_cache', None)
+    if cache is None:
+        return
+    
+    cache = [c for c in cache if c['id'] != channel['id']]
+    cache.append(channel)
+    cache.sort(key=_channel_sort_key)
+    request.app.state.channels_cache = cache
+
+
+def cache_remove_channel(request: Request, channel_id: int):
+    """Drop a channel from the cache (no-op if not loaded yet)."""
+    cache = getattr(request.app.state, 'channels_cache', None)
+    if cache is None:
+        return
+    
+    request.app.state.channels_cache = [c for c in cache if c['id'] != channel_id]
 
 
 @router.get("", response_class=HTMLResponse)
 @require_auth
 async def list_channels(request: Request):
     """List all active channels."""
-    pool = request.app.state.db_pool
-    channels = await get_active_channels(pool)
+    channels = await get_cached_channels(request)
     
     return templates.TemplateResponse("partials/channels_table.html", {
         "request": request,
@@ -53,11 +129,7 @@ async def add_channel(
     
     # Check if Telegram is connected
     if not await telegram_client.is_user_authorized():
-        return HTMLResponse("""
-            <div class="p-4 bg-red-500/20 border border-red-500/50 rounded-lg text-red-400">
-                <p>Telegram not connected. Please authenticate first.</p>
-            </div>
-        """)
+        return HTMLResponse(_NOT_CONNECTED_HTML)
     
     try:
         # Clean input
@@ -83,12 +155,15 @@ async def add_channel(
             "username": getattr(entity, 'username', None)
         }
         
-        await insert_channel(pool, channel_data)
+        channel = await insert_channel(pool, channel_data)
+        if channel:
+            cache_upsert_channel(request, channel)
+            await register_new_message_handler(telegram_client, pool)
         
         logger.info(f"Added channel: {channel_data['name']} (ID: {entity.id})")
         
-        # Refresh channel list
-        channels = await get_active_channels(pool)
+        # Render from the patched cache instead of re-querying
+        channels = await get_cached_channels(request)
         return templates.TemplateResponse("partials/channels_table.html", {
             "request": request,
             "channels": channels,
@@ -96,17 +171,9 @@ async def add_channel(
         })
         
     except UsernameNotOccupiedError:
-        return HTMLResponse("""
-            <div class="p-4 bg-red-500/20 border border-red-500/50 rounded-lg text-red-400">
-                <p>Channel/username not found.</p>
-            </div>
-        """)
+        return HTMLResponse(_NOT_FOUND_HTML)
     except ChannelPrivateError:
-        return HTMLResponse("""
-            <div class="p-4 bg-red-500/20 border border-red-500/50 rounded-lg text-red-400">
-                <p>Channel is private. Join it first.</p>
-            </div>
-        """)
+        return HTMLResponse(_PRIVATE_HTML)
     except Exception as e:
         logger.error(f"Failed to add channel: {e}")
         return HTMLResponse(f"""
@@ -128,7 +195,7 @@ async def scan_channel_now(request: Request, channel_id: int):
         raise HTTPException(status_code=404, detail="Channel not found")
     
     try:
-        new_count, max_id = await scan_channel(
+        new_count, _ = await scan_channel(
             telegram_client,
             pool,
             channel_id,
@@ -136,15 +203,7 @@ async def scan_channel_now(request: Request, channel_id: int):
             full_scan=False
         )
         
-        # Update last scanned message ID
-        if max_id > channel.get('last_scanned_message_id', 0):
-            await update_channel_last_scanned(pool, channel_id, max_id)
-        
-        return HTMLResponse(f"""
-            <div class="p-3 bg-green-500/20 border border-green-500/50 rounded text-green-400 text-sm">
-                Found {new_count} new audio/PDF files
-            </div>
-        """)
+        return HTMLResponse(_SCAN_PREFIX + b"%d" % new_count + _SCAN_SUFFIX)
         
     except Exception as e:
         logger.error(f"Manual scan failed: {e}")
@@ -173,7 +232,7 @@ async def full_scan_channel(request: Request, channel_id: int):
     try:
         logger.info(f"Starting FULL scan of channel {channel_id}")
         
-        new_count, max_id = await scan_channel(
+        new_count, _ = await scan_channel(
             telegram_client,
             pool,
             channel_id,
@@ -181,14 +240,7 @@ async def full_scan_channel(request: Request, channel_id: int):
             full_scan=True
         )
         
-        # Update last scanned message ID
-        await update_channel_last_scanned(pool, channel_id, max_id)
-        
-        return HTMLResponse(f"""
-            <div class="p-3 bg-green-500/20 border border-green-500/50 rounded text-green-400 text-sm">
-                Full scan complete: {new_count} audio/PDF files found
-            </div>
-        """)
+        return HTMLResponse(_FULL_SCAN_PREFIX + b"%d" % new_count + _FULL_SCAN_SUFFIX)
         
     except Exception as e:
         logger.error(f"Full scan failed: {e}")
@@ -208,7 +260,9 @@ async def remove_channel(request: Request, channel_id: int):
     success = await deactivate_channel(pool, channel_id)
     
     if success:
-        channels = await get_active_channels(pool)
+        cache_remove_channel(request, channel_id)
+        await register_new_message_handler(request.app.state.telegram_client, pool)
+        channels = await get_cached_channels(request)
         return templates.TemplateResponse("partials/channels_table.html", {
             "request": request,
             "channels": channels
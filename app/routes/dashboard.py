@@ -3,13 +3,17 @@ TeleMinion V2 Dashboard Routes
 
 Server-side rendered dashboard with HTMX.
 """
+import asyncio
+import base64
+import binascii
 import logging
+from datetime import datetime
 from typing import Optional
 
 from fastapi import APIRouter, Request, Form
 from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.templating import Jinja2Templates
 
+from ..templating import templates, stream_template
 from ..auth import (
     require_auth, 
     login_user, 
@@ -23,13 +27,36 @@ from ..database import (
     get_dashboard_stats,
     get_files_by_status,
     get_active_files,
-    get_history_files,
-    get_active_channels
+    get_history_files
 )
+from .channels import get_cached_channels
 
 logger = logging.getLogger(__name__)
 router = APIRouter(tags=["dashboard"])
-templates = Jinja2Templates(directory="templates")
+
+
+def encode_cursor(updated_at: datetime, file_id: int) -> str:
+    """Encode a keyset position as an opaque URL-safe cursor."""
+    raw = f"{updated_at.isoformat()}|{file_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[tuple[datetime, int]]:
+    """Decode a cursor from encode_cursor. Returns None if missing or invalid."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        updated_at, file_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(updated_at), int(file_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def paginate(total: int, per_page: int, page: int) -> tuple[int, bool, bool]:
+    """Return (total_pages, has_next, has_prev) using integer math only."""
+    total_pages = (total + per_page - 1) // per_page or 1
+    return total_pages, page < total_pages, page > 1
 
 
 @router.get("/login", response_class=HTMLResponse)
@@ -92,16 +119,18 @@ async def dashboard(request: Request):
     # Get authentication status
     auth_status = getattr(request.app.state, 'auth_status', {})
     
-    # Get initial stats
-    stats = await get_dashboard_stats(pool)
-    
-    # Check Telegram connection
+    # Get initial stats and check Telegram connection concurrently
     telegram_client = request.app.state.telegram_client
-    telegram_connected = False
-    try:
-        telegram_connected = await telegram_client.is_user_authorized()
-    except Exception:
-        pass
+    stats, telegram_connected = await asyncio.gather(
+        get_dashboard_stats(pool),
+        telegram_client.is_user_authorized(),
+        return_exceptions=True
+    )
+    
+    if isinstance(stats, BaseException):
+        raise stats
+    if isinstance(telegram_connected, BaseException):
+        telegram_connected = False
     
     return templates.TemplateResponse("dashboard.html", {
         "request": request,
@@ -142,15 +171,24 @@ async def pending_files(
         pool, "PENDING", page, per_page, sort, order
     )
     
-    total_pages = (total + per_page - 1) // per_page
+    total_pages, has_next, has_prev = paginate(total, per_page, page)
+    if not files and page > total_pages:
+        # Past the end (e.g. the last page was just approved): show the last page
+        page = total_pages
+        files, total = await get_files_by_status(
+            pool, "PENDING", page, per_page, sort, order
+        )
+        total_pages, has_next, has_prev = paginate(total, per_page, page)
     
-    return templates.TemplateResponse("partials/pending_table.html", {
+    return stream_template("partials/pending_table.html", {
         "request": request,
         "files": files,
         "page": page,
         "per_page": per_page,
         "total": total,
         "total_pages": total_pages,
+        "has_next": has_next,
+        "has_prev": has_prev,
         "sort": sort,
         "order": order,
         "categories": CATEGORIES,
@@ -165,7 +203,7 @@ async def active_files(request: Request):
     pool = request.app.state.db_pool
     files = await get_active_files(pool)
     
-    return templates.TemplateResponse("partials/active_table.html", {
+    return stream_template("partials/active_table.html", {
         "request": request,
         "files": files
     })
@@ -175,23 +213,30 @@ async def active_files(request: Request):
 @require_auth
 async def history_files(
     request: Request,
-    page: int = 1,
+    cursor: Optional[str] = None,
     per_page: int = 50
 ):
     """History table partial (completed + failed)."""
     pool = request.app.state.db_pool
     
-    failed, completed, total = await get_history_files(pool, page, per_page)
-    total_pages = (total + per_page - 1) // per_page
+    # An invalid or stale cursor falls back to the first page
+    position = decode_cursor(cursor)
+    failed, completed, has_next = await get_history_files(
+        pool, per_page, position
+    )
     
-    return templates.TemplateResponse("partials/history_table.html", {
+    next_cursor = None
+    if has_next:
+        last = completed[-1]
+        next_cursor = encode_cursor(last['updated_at'], last['id'])
+    
+    return stream_template("partials/history_table.html", {
         "request": request,
         "failed_files": failed,
         "completed_files": completed,
-        "page": page,
         "per_page": per_page,
-        "total": total,
-        "total_pages": total_pages
+        "has_prev": position is not None,
+        "next_cursor": next_cursor
     })
 
 
@@ -199,8 +244,7 @@ async def history_files(
 @require_auth
 async def channels_tab(request: Request):
     """Channels management table partial."""
-    pool = request.app.state.db_pool
-    channels = await get_active_channels(pool)
+    channels = await get_cached_channels(request)
     
     return templates.TemplateResponse("partials/channels_table.html", {
         "request": request,
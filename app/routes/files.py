@@ -3,23 +3,33 @@ TeleMinion V2 File Routes
 
 File management endpoints including batch operations and n8n callbacks.
 """
+import asyncio
 import logging
 from typing import List, Optional
 
 from fastapi import APIRouter, Request, HTTPException, Form
 from fastapi.responses import HTMLResponse, JSONResponse
-from fastapi.templating import Jinja2Templates
 
+from ..templating import templates
 from ..auth import require_auth, require_auth_api
-from ..config import CATEGORIES, get_category_options, MIME_CATEGORY_OPTIONS
+from ..config import (
+    settings,
+    CATEGORIES,
+    get_category_options,
+    MIME_DEFAULTS,
+    MIME_CATEGORY_OPTIONS
+)
 from ..database import (
     get_file_by_id,
+    get_files_by_ids,
     get_files_by_status,
     update_file_status,
     update_file_category,
+    bulk_approve_files,
     mark_file_processed,
     get_unprocessed_files
 )
+from ..worker import enqueue_download, enqueue_downloads
 from ..models import (
     FileStatus,
     BatchApprovalRequest,
@@ -29,7 +39,21 @@ from ..models import (
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/files", tags=["files"])
-templates = Jinja2Templates(directory="templates")
+
+
+async def _approve_and_enqueue(state, file_ids: List[int], category: str) -> List[int]:
+    """
+    Mark pending files QUEUED and put them on the download queue.
+    Returns IDs that were actually approved.
+    """
+    updated_ids = await bulk_approve_files(
+        state.db_pool, file_ids, category, FileStatus.QUEUED
+    )
+    
+    # Add to download queue (only waits if the queue is full)
+    await enqueue_downloads(state.download_queue, state.in_flight, updated_ids)
+    
+    return updated_ids
 
 
 # =============================================================================
@@ -79,7 +103,7 @@ async def approve_file(
     await update_file_status(pool, file_id, FileStatus.QUEUED)
     
     # Add to download queue
-    await download_queue.put(file_id)
+    await enqueue_download(download_queue, request.app.state.in_flight, file_id)
     
     # Return updated row
     file = await get_file_by_id(pool, file_id)
@@ -136,7 +160,7 @@ async def retry_file(request: Request, file_id: int):
     )
     
     # Add to download queue
-    await download_queue.put(file_id)
+    await enqueue_download(download_queue, request.app.state.in_flight, file_id)
     
     file = await get_file_by_id(pool, file_id)
     return templates.TemplateResponse("partials/file_row.html", {
@@ -168,37 +192,25 @@ async def batch_preview(request: Request):
     if not file_ids:
         return HTMLResponse("<p class='text-gray-400'>No files selected</p>")
     
-    # Group files by type
-    audio_files = []
-    pdf_files = []
-    
-    for file_id in file_ids:
-        file = await get_file_by_id(pool, file_id)
-        if file:
-            if file.get('file_type') == 'audio':
-                audio_files.append(file)
-            elif file.get('file_type') == 'pdf':
-                pdf_files.append(file)
-    
-    groups = []
-    
-    if audio_files:
-        groups.append(FileGroupSummary(
-            file_type="audio",
-            count=len(audio_files),
-            file_ids=[f['id'] for f in audio_files],
-            default_category=audio_files[0].get('destination_category', 'messages'),
-            category_options=MIME_CATEGORY_OPTIONS.get('audio', ['messages', 'songs'])
-        ))
-    
-    if pdf_files:
-        groups.append(FileGroupSummary(
-            file_type="pdf",
-            count=len(pdf_files),
-            file_ids=[f['id'] for f in pdf_files],
-            default_category=pdf_files[0].get('destination_category', 'ror'),
-            category_options=MIME_CATEGORY_OPTIONS.get('pdf', ['ror', 'books'])
-        ))
+    # Fetch all selected files in one query, then group by type
+    rows = await get_files_by_ids(pool, file_ids)
+    by_type = {file_type: [] for file_type in MIME_DEFAULTS}
+    for f in rows:
+        group = by_type.get(f['file_type'])
+        if group is not None:
+            group.append(f)
+    
+    groups = [
+        FileGroupSummary(
+            file_type=file_type,
+            count=len(files),
+            file_ids=[f['id'] for f in files],
+            default_category=files[0]['destination_category'] or MIME_DEFAULTS[file_type],
+            category_options=MIME_CATEGORY_OPTIONS.get(file_type, [MIME_DEFAULTS[file_type]])
+        )
+        for file_type, files in by_type.items()
+        if files
+    ]
     
     return templates.TemplateResponse("partials/batch_modal.html", {
         "request": request,
@@ -214,9 +226,6 @@ async def batch_approve(request: Request):
     """
     Approve batch of files with category assignments.
     """
-    pool = request.app.state.db_pool
-    download_queue = request.app.state.download_queue
-    
     form = await request.form()
     
     approved = 0
@@ -240,43 +249,30 @@ async def batch_approve(request: Request):
             errors.append(f"Invalid category for {file_type}")
             continue
         
-        for file_id in file_ids:
-            try:
-                # Update category
-                await update_file_category(pool, file_id, category)
-                
-                # Update status to QUEUED
-                await update_file_status(pool, file_id, FileStatus.QUEUED)
-                
-                # Add to download queue
-                await download_queue.put(file_id)
-                
-                approved += 1
-            except Exception as e:
-                errors.append(f"File {file_id}: {str(e)}")
-    
-    # Return success message
-    if errors:
-        return HTMLResponse(f"""
-            <div class="p-4 bg-amber-500/20 border border-amber-500/50 rounded-lg">
-                <p class="text-amber-400">Approved {approved} files with {len(errors)} errors</p>
-                <ul class="mt-2 text-sm text-amber-300">
-                    {"".join(f"<li>{e}</li>" for e in errors[:5])}
-                </ul>
-            </div>
-        """)
-    
-    return HTMLResponse(f"""
-        <div class="p-4 bg-green-500/20 border border-green-500/50 rounded-lg">
-            <p class="text-green-400">✓ Approved {approved} files for download</p>
-            <script>
-                setTimeout(() => {{
-                    htmx.trigger('#pending-content', 'refresh');
-                    document.getElementById('batch-modal').close();
-                }}, 1500);
-            </script>
-        </div>
-    """)
+        if not file_ids:
+            continue
+        
+        # Update category and status for the whole group in one query;
+        # IDs missing from the result are the errors. Shielded so a client
+        # disconnect can't leave rows QUEUED but never put on the queue.
+        try:
+            updated_ids = await asyncio.shield(
+                _approve_and_enqueue(request.app.state, file_ids, category)
+            )
+        except Exception as e:
+            errors.append(f"{file_type} files: {str(e)}")
+            continue
+        
+        missing = set(file_ids).difference(updated_ids)
+        errors.extend(f"File {fid}: not found or not pending" for fid in sorted(missing))
+        
+        approved += len(updated_ids)
+    
+    return templates.TemplateResponse("partials/batch_result.html", {
+        "request": request,
+        "approved": approved,
+        "errors": errors
+    })
 
 
 # =============================================================================
@@ -289,10 +285,23 @@ async def api_unprocessed_files(request: Request):
     """
     Get files ready for n8n processing.
     Called by n8n to poll for new uploads.
+    
+    Long-polls: if nothing is ready, waits up to UNPROCESSED_POLL_TIMEOUT
+    seconds for the worker to complete an upload before answering.
     """
     pool = request.app.state.db_pool
     files = await get_unprocessed_files(pool)
     
+    if not files and settings.UNPROCESSED_POLL_TIMEOUT > 0:
+        event = request.app.state.new_file_event
+        try:
+            await asyncio.wait_for(event.wait(), timeout=settings.UNPROCESSED_POLL_TIMEOUT)
+            files = await get_unprocessed_files(pool)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            event.clear()
+    
     return {
         "files": files,
         "count": len(files)
@@ -313,10 +322,13 @@ async def api_mark_processed(
     """
     pool = request.app.state.db_pool
     
-    try:
-        data = await request.json()
-    except:
-        data = {}
+    # Only parse JSON bodies; anything else (or a malformed body) means defaults
+    data = {}
+    if request.headers.get('content-type', '').startswith('application/json'):
+        try:
+            data = await request.json()
+        except ValueError:
+            data = {}
     
     success = await mark_file_processed(pool, file_id, data)
     
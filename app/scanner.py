@@ -6,27 +6,95 @@ Features: MIME type detection, auto-category assignment, deduplication.
 """
 import asyncio
 import logging
-from typing import Optional
+from collections import defaultdict
+from contextlib import nullcontext
+from typing import NamedTuple, Optional
 
-from telethon import TelegramClient
+from telethon import TelegramClient, events, utils
 from telethon.errors import FloodWaitError, ChannelPrivateError
 from telethon.tl.types import (
     DocumentAttributeFilename,
     DocumentAttributeAudio,
-    MessageMediaDocument
+    InputMessagesFilterDocument,
+    InputMessagesFilterMusic,
+    InputMessagesFilterVoice,
+    MessageMediaDocument,
+    PeerChannel
 )
 
-from .config import settings, get_category_for_mime
+from .config import settings, MIME_DEFAULTS
 from .database import (
     get_active_channels,
-    update_channel_last_scanned,
-    insert_file
+    get_channel_by_id,
+    insert_file,
+    insert_files_bulk
 )
 
 logger = logging.getLogger(__name__)
 
+# Telegram files music and voice messages apart from other documents, so a
+# scan runs all three filters to see every audio/PDF message
+_SCAN_FILTERS = (
+    InputMessagesFilterDocument,
+    InputMessagesFilterMusic,
+    InputMessagesFilterVoice
+)
+
+# MIME type -> file type for the common cases; other audio/* types are
+# caught by the prefix fallback in get_file_info
+PDF_MIME_TYPE = "application/pdf"
+AUDIO_MIME_TYPES = frozenset({
+    "audio/mpeg",
+    "audio/mp4",
+    "audio/x-m4a",
+    "audio/ogg",
+    "audio/opus",
+    "audio/aac",
+    "audio/wav",
+    "audio/x-wav",
+    "audio/flac",
+})
+_MIME_TO_TYPE = {mime: "audio" for mime in AUDIO_MIME_TYPES}
+_MIME_TO_TYPE[PDF_MIME_TYPE] = "pdf"
+
+# Discovered files are inserted in batches of this size
+INSERT_BATCH_SIZE = 100
+
+# Resolved input peers by channel ID, reused across scan cycles and downloads
+_ENTITY_CACHE: dict = {}
+
+# One resolution per channel at a time (concurrent callers wait for the cache)
+_ENTITY_LOCKS: defaultdict = defaultdict(asyncio.Lock)
+
+# Loop time before which no scheduled scan should start (pushed out by FloodWait)
+_next_allowed_scan_time = 0.0
+
+# Currently registered NewMessage handler (replaced when channels change)
+_new_message_handler = None
+_handler_lock = asyncio.Lock()
+
+
+def _defer_scans(seconds: float):
+    """Hold off scheduled scans for `seconds` after a FloodWait."""
+    global _next_allowed_scan_time
+    _next_allowed_scan_time = max(
+        _next_allowed_scan_time,
+        asyncio.get_running_loop().time() + seconds
+    )
+
 
-def get_file_info(message) -> Optional[dict]:
+class FileInfo(NamedTuple):
+    """File information extracted from a Telegram message."""
+    file_name: str
+    file_size: int
+    file_type: str
+    mime_type: str
+    is_voice: bool
+    duration: Optional[int]
+    destination_category: str
+
+
+def get_file_info(message) -> Optional[FileInfo]:
     """
     Extract file information from a Telegram message.
     Returns None if not a supported file type (audio/PDF only).
@@ -41,16 +109,13 @@ def get_file_info(message) -> Optional[dict]:
     # Get MIME type
     mime_type = document.mime_type or ""
     
-    # Check if supported type
-    is_audio = mime_type.startswith("audio/")
-    is_pdf = mime_type == "application/pdf"
-    
-    if not is_audio and not is_pdf:
-        # Skip unsupported file types
-        return None
-    
-    # Get file type
-    file_type = "audio" if is_audio else "pdf"
+    # Get file type (audio/PDF only)
+    file_type = _MIME_TO_TYPE.get(mime_type)
+    if file_type is None:
+        if not mime_type.startswith("audio/"):
+            # Skip unsupported file types
+            return None
+        file_type = "audio"
     
     # Get filename
     file_name = None
@@ -66,21 +131,71 @@ def get_file_info(message) -> Optional[dict]:
     
     # Generate filename if not present
     if not file_name:
-        ext = "mp3" if is_audio else "pdf"
+        ext = "mp3" if file_type == "audio" else "pdf"
         file_name = f"{file_type}_{message.id}.{ext}"
     
-    # Get default category based on MIME type
-    default_category = get_category_for_mime(mime_type)
+    # Get default category based on file type
+    default_category = MIME_DEFAULTS[file_type]
     
-    return {
-        "file_name": file_name,
-        "file_size": document.size,
-        "file_type": file_type,
-        "mime_type": mime_type,
-        "is_voice": is_voice,
-        "duration": duration,
-        "destination_category": default_category
-    }
+    return FileInfo(
+        file_name,
+        document.size,
+        file_type,
+        mime_type,
+        is_voice,
+        duration,
+        default_category
+    )
+
+
+async def resolve_channel_entity(client: TelegramClient, pool, channel_id: int):
+    """
+    Resolve a channel to an input peer, using the cache when possible.
+    Falls back to direct ID -> PeerChannel -> username resolution on a miss.
+    """
+    entity = _ENTITY_CACHE.get(channel_id)
+    if entity is not None:
+        return entity
+    
+    async with _ENTITY_LOCKS[channel_id]:
+        entity = _ENTITY_CACHE.get(channel_id)
+        if entity is None:
+            entity = await _lookup_channel_entity(client, pool, channel_id)
+            _ENTITY_CACHE[channel_id] = entity
+    
+    return entity
+
+
+async def _lookup_channel_entity(client: TelegramClient, pool, channel_id: int):
+    """Run the resolution ladder for resolve_channel_entity (no caching)."""
+    try:
+        # 1. Try direct ID resolution
+        entity = await client.get_entity(channel_id)
+    except Exception as e1:
+        logger.warning(f"Direct entity resolution failed for {channel_id}: {e1}")
+        
+        # 2. Try PeerChannel
+        try:
+            entity = await client.get_entity(PeerChannel(channel_id))
+        except Exception as e2:
+            logger.warning(f"PeerChannel resolution failed for {channel_id}: {e2}")
+            
+            # 3. Try username from the database
+            try:
+                channel_data = await get_channel_by_id(pool, channel_id)
+                username = channel_data.get('username') if channel_data else None
+                
+                if username:
+                    logger.info(f"Trying resolution by username: {username}")
+                    entity = await client.get_entity(username)
+                else:
+                    raise ValueError("No username available")
+            except Exception as e3:
+                logger.error(f"Username resolution failed: {e3}")
+                raise ValueError(f"Cannot resolve channel {channel_id}")
+    
+    # Input peers are all iter_messages/get_messages need and are cheaper to keep
+    return await client.get_input_entity(entity)
 
 
 async def scan_channel(
@@ -88,7 +203,8 @@ async def scan_channel(
     pool,
     channel_id: int,
     last_message_id: int = 0,
-    full_scan: bool = False
+    full_scan: bool = False,
+    conn=None
 ) -> tuple[int, int]:
     """
     Scan a channel for new audio/PDF files.
@@ -96,84 +212,163 @@ async def scan_channel(
     
     If full_scan=True, scans ALL messages (for initial import).
     Otherwise, only scans messages newer than last_message_id.
+    
+    The channel's scan watermark is advanced together with the final insert
+    batch, and only when the scan completes without error.
+    
+    The whole scan uses a single database connection (acquired from the pool
+    unless one is passed in).
     """
     new_files = 0
     max_message_id = last_message_id
+    pending = []
     
     # For full scan, don't use min_id filter and increase limit
     scan_limit = None if full_scan else 500  # None = no limit
     min_id = 0 if full_scan else last_message_id
     
-    try:
-        # Get the channel entity (required for proper entity resolution after restart)
+    async with (pool.acquire() if conn is None else nullcontext(conn)) as conn:
         try:
-            # 1. Try direct ID resolution
-            entity = await client.get_entity(channel_id)
-        except Exception as e1:
-            logger.warning(f"Direct entity resolution failed for {channel_id}: {e1}")
+            # Get the channel entity (required for proper entity resolution after restart)
+            entity = await resolve_channel_entity(client, conn, channel_id)
             
-            # 2. Try PeerChannel
-            try:
-                from telethon.tl.types import PeerChannel
-                entity = await client.get_entity(PeerChannel(channel_id))
-            except Exception as e2:
-                logger.warning(f"PeerChannel resolution failed for {channel_id}: {e2}")
-                
-                # 3. Try Username if available (we don't have username in args, need to fetch from DB)
-                # In scanner, we can query the DB for the username
-                try:
-                    from .database import get_channel_by_id
-                    channel_data = await get_channel_by_id(pool, channel_id)
-                    username = channel_data.get('username') if channel_data else None
+            logger.info(f"Scanning channel {channel_id} (full_scan={full_scan}, min_id={min_id})")
+            
+            # The filters below hide text messages, so read the real channel
+            # head first to keep the watermark moving past them. It is only
+            # stored once every filter has been scanned.
+            head = await client.get_messages(entity, limit=1)
+            if head:
+                max_message_id = max(max_message_id, head[0].id)
+            
+            # Iterate through document, music and voice messages (newest first).
+            # Telegram caps history pages at 100 messages; skip Telethon's
+            # inter-page sleep (1s per page on unbounded full scans) and rely
+            # on FloodWaitError instead.
+            for scan_filter in _SCAN_FILTERS:
+                async for message in client.iter_messages(
+                    entity,
+                    limit=scan_limit,
+                    min_id=min_id,
+                    filter=scan_filter,
+                    wait_time=0
+                ):
+                    max_message_id = max(max_message_id, message.id)
                     
-                    if username:
-                        logger.info(f"Trying resolution by username: {username}")
-                        entity = await client.get_entity(username)
-                    else:
-                        raise ValueError("No username available")
-                except Exception as e3:
-                    logger.error(f"Username resolution failed: {e3}")
-                    raise ValueError(f"Cannot resolve channel {channel_id}")
+                    # Extract file info
+                    file_info = get_file_info(message)
+                    if not file_info:
+                        continue
+                    
+                    # Buffer file record for batch insert (column order of insert_files_bulk)
+                    pending.append((
+                        channel_id,
+                        message.id,
+                        file_info.file_name,
+                        file_info.file_size,
+                        file_info.file_type,
+                        file_info.mime_type,
+                        file_info.destination_category
+                    ))
+                    
+                    if len(pending) >= INSERT_BATCH_SIZE:
+                        new_files += len(await insert_files_bulk(conn, pending))
+                        pending.clear()
+                        logger.info(f"Progress: {new_files} files discovered...")
+            
+            # Final batch + watermark advance in one transaction
+            watermark = max_message_id if max_message_id > last_message_id else None
+            new_files += len(await insert_files_bulk(conn, pending, channel_id, watermark))
+            pending.clear()
+            
+            logger.info(f"Scan complete: {new_files} audio/PDF files found")
         
-        logger.info(f"Scanning channel {channel_id} (full_scan={full_scan}, min_id={min_id})")
+        except FloodWaitError as e:
+            logger.warning(f"FloodWait scanning channel {channel_id}: {e.seconds}s")
+            _defer_scans(e.seconds)
+        except ChannelPrivateError:
+            _ENTITY_CACHE.pop(channel_id, None)
+            logger.error(f"Channel {channel_id} is private or access denied")
+        except ValueError as e:
+            _ENTITY_CACHE.pop(channel_id, None)
+            logger.error(f"Error scanning channel {channel_id}: {e}")
+        except Exception as e:
+            logger.error(f"Error scanning channel {channel_id}: {e}")
         
-        # Iterate through messages (newest first)
-        async for message in client.iter_messages(
-            entity,
-            limit=scan_limit,
-            min_id=min_id
-        ):
-            max_message_id = max(max_message_id, message.id)
-            
-            # Extract file info
-            file_info = get_file_info(message)
+        # Don't lose files buffered before an error (watermark is left as is)
+        if pending:
+            new_files += len(await insert_files_bulk(conn, pending))
+    
+    return new_files, max_message_id
+
+
+async def register_new_message_handler(client: TelegramClient, pool):
+    """
+    Register a NewMessage handler for all active channels so new files are
+    discovered as soon as Telegram pushes them.
+    Call again whenever channels are added or removed to refresh the filter.
+    """
+    global _new_message_handler
+    
+    async with _handler_lock:
+        if _new_message_handler is not None:
+            client.remove_event_handler(_new_message_handler)
+            _new_message_handler = None
+        
+        channels = await get_active_channels(pool)
+        if not channels:
+            logger.debug("No active channels, NewMessage handler not registered")
+            return
+        
+        async def on_new_message(event):
+            file_info = get_file_info(event.message)
             if not file_info:
-                continue
+                return
             
-            # Insert file record
-            file_data = {
+            channel_id = utils.get_peer_id(event.message.peer_id, add_mark=False)
+            file_id = await insert_file(pool, {
                 "channel_id": channel_id,
-                "message_id": message.id,
-                **file_info
-            }
-            
-            file_id = await insert_file(pool, file_data)
+                "message_id": event.message.id,
+                **file_info._asdict()
+            })
             if file_id:
-                new_files += 1
-                if new_files % 100 == 0:
-                    logger.info(f"Progress: {new_files} files discovered...")
+                logger.info(f"New file {file_id} discovered in channel {channel_id}: {file_info.file_name}")
         
-        logger.info(f"Scan complete: {new_files} audio/PDF files found")
+        client.add_event_handler(
+            on_new_message,
+            events.NewMessage(chats=[PeerChannel(c['id']) for c in channels])
+        )
+        _new_message_handler = on_new_message
+        logger.info(f"Listening for new messages in {len(channels)} channels")
+
+
+async def _scan_active_channel(
+    client: TelegramClient,
+    pool,
+    channel: dict,
+    semaphore: asyncio.Semaphore
+) -> int:
+    """Scan one channel from the scanner loop, bounded by the semaphore."""
+    async with semaphore:
+        # Respect any FloodWait reported by an earlier scan
+        delay = _next_allowed_scan_time - asyncio.get_running_loop().time()
+        if delay > 0:
+            await asyncio.sleep(delay)
         
-    except FloodWaitError as e:
-        logger.warning(f"FloodWait scanning channel {channel_id}: {e.seconds}s")
-        await asyncio.sleep(e.seconds)
-    except ChannelPrivateError:
-        logger.error(f"Channel {channel_id} is private or access denied")
-    except Exception as e:
-        logger.error(f"Error scanning channel {channel_id}: {e}")
-    
-    return new_files, max_message_id
+        channel_id = channel['id']
+        last_id = channel.get('last_scanned_message_id', 0)
+        
+        logger.debug(f"Scanning channel {channel.get('name', channel_id)}")
+        
+        new_count, _ = await scan_channel(
+            client, pool, channel_id, last_id
+        )
+        
+        # Only pace after channels that actually had new files
+        if new_count > 0:
+            await asyncio.sleep(1)
+        
+        return new_count
 
 
 async def channel_scanner(
@@ -182,6 +377,8 @@ async def channel_scanner(
 ):
     """
     Background task that periodically scans all active channels.
+    New files normally arrive through the NewMessage handler; this loop is
+    the reconciliation sweep that catches anything missed while offline.
     """
     logger.info("Channel scanner started")
     
@@ -189,8 +386,8 @@ async def channel_scanner(
         try:
             # Circuit Breaker: Check connection
             if not client.is_connected():
-                logger.warning("Scanner paused: Telegram client disconnected. Waiting...")
-                await asyncio.sleep(settings.SCAN_INTERVAL)
+                logger.warning("Scanner paused: Telegram client disconnected. Waiting 5s...")
+                await asyncio.sleep(5)
                 try:
                     await client.connect()
                 except:
@@ -199,8 +396,8 @@ async def channel_scanner(
 
             # Check if client is authorized
             if not await client.is_user_authorized():
-                logger.warning("Telegram client not authorized, skipping scan")
-                await asyncio.sleep(settings.SCAN_INTERVAL)
+                logger.warning("Telegram client not authorized, retrying in 5s")
+                await asyncio.sleep(5)
                 continue
             
             # Get active channels
@@ -209,24 +406,20 @@ async def channel_scanner(
             if not channels:
                 logger.debug("No active channels to scan")
             else:
+                # Scan channels concurrently, a few at a time
+                semaphore = asyncio.Semaphore(settings.MAX_CONCURRENT_SCANS)
+                results = await asyncio.gather(
+                    *(_scan_active_channel(client, pool, channel, semaphore)
+                      for channel in channels),
+                    return_exceptions=True
+                )
+                
                 total_new = 0
-                for channel in channels:
-                    channel_id = channel['id']
-                    last_id = channel.get('last_scanned_message_id', 0)
-                    
-                    logger.debug(f"Scanning channel {channel.get('name', channel_id)}")
-                    
-                    new_count, max_id = await scan_channel(
-                        client, pool, channel_id, last_id
-                    )
-                    
-                    if max_id > last_id:
-                        await update_channel_last_scanned(pool, channel_id, max_id)
-                    
-                    total_new += new_count
-                    
-                    # Small delay between channels
-                    await asyncio.sleep(1)
+                for channel, result in zip(channels, results):
+                    if isinstance(result, Exception):
+                        logger.error(f"Error scanning channel {channel['id']}: {result}")
+                    else:
+                        total_new += result
                 
                 if total_new > 0:
                     logger.info(f"Scan complete: {total_new} new files discovered")
@@ -239,6 +432,6 @@ async def channel_scanner(
             break
         except Exception as e:
             logger.error(f"Scanner error: {e}")
-            await asyncio.sleep(settings.SCAN_INTERVAL)
+            await asyncio.sleep(5)
     
     logger.info("Channel scanner stopped")
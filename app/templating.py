@@ -0,0 +1,50 @@
+"""
+TeleMinion V2 Templating
+
+Shared Jinja2 environment used by all route modules.
+"""
+from typing import Optional
+
+import jinja2
+from fastapi.responses import StreamingResponse
+from fastapi.templating import Jinja2Templates
+from starlette.concurrency import iterate_in_threadpool
+
+_SIZE_UNITS = ("B", "KB", "MB", "GB", "TB")
+
+
+def format_file_size(size: Optional[int]) -> str:
+    """Format a byte count for display, picking the unit from bit_length."""
+    if size is None:
+        return "Unknown"
+    if size < 1024:
+        return f"{size} B"
+    unit = min((size.bit_length() - 1) // 10, 4)
+    return f"{size / (1 << (10 * unit)):.1f} {_SIZE_UNITS[unit]}"
+
+
+# Single environment so every router shares one template cache.
+# Templates are baked into the image, so skip mtime checks on each render.
+templates = Jinja2Templates(
+    env=jinja2.Environment(
+        loader=jinja2.FileSystemLoader("templates"),
+        autoescape=True,
+        auto_reload=False,
+        cache_size=400
+    )
+)
+templates.env.filters["format_file_size"] = format_file_size
+
+
+def stream_template(name: str, context: dict, buffer_size: int = 20) -> StreamingResponse:
+    """
+    Render a template as a chunked HTML stream.
+    Used for large table partials so rows are sent as they are rendered
+    instead of building the whole page in memory first.
+    """
+    stream = templates.get_template(name).stream(context)
+    stream.enable_buffering(size=buffer_size)
+    return StreamingResponse(
+        iterate_in_threadpool(stream),
+        media_type="text/html"
+    )
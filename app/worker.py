@@ -5,20 +5,27 @@ Background worker that processes the download queue.
 Features: Queue persistence, bucket routing, retry logic, n8n webhook.
 """
 import asyncio
+import concurrent.futures
+import functools
 import hashlib
+import io
 import logging
-import os
+import random
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Optional
+from typing import AsyncIterator, Dict, List, Optional
 
-import aiofiles
 import httpx
+from minio.error import S3Error
 from telethon import TelegramClient
 from telethon.errors import FloodWaitError
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
 
 from .config import settings, get_bucket_for_category, CATEGORIES
 from .database import (
-    get_file_by_id, 
+    claim_queued_file, 
     update_file_status, 
     increment_retry_count,
     get_queued_file_ids,
@@ -26,17 +33,200 @@ from .database import (
     check_content_hash_exists
 )
 from .models import FileStatus, WebhookPayload
+from .scanner import resolve_channel_entity
 
 logger = logging.getLogger(__name__)
 
+# Transient failures: re-queued automatically with backoff instead of FAILED
+# (minio-py surfaces network problems as raw urllib3 errors)
+RECOVERABLE_ERRORS = (ConnectionError, TimeoutError, S3Error, Urllib3HTTPError)
 
-async def calculate_content_hash(file_path: str) -> str:
-    """Calculate SHA-256 hash of file content."""
-    sha256 = hashlib.sha256()
-    async with aiofiles.open(file_path, 'rb') as f:
-        while chunk := await f.read(8192):
-            sha256.update(chunk)
-    return sha256.hexdigest()
+# Loop time before which no download should start (pushed out by FloodWait)
+_next_download_time = 0.0
+
+# Buckets confirmed to exist (skips a HEAD request per upload)
+_known_buckets: set = set()
+
+# Blocking MinIO uploads run here, one thread per download worker, so they
+# never compete with other to_thread work for the default executor
+_upload_executor = ThreadPoolExecutor(
+    max_workers=settings.DOWNLOAD_CONCURRENCY,
+    thread_name_prefix="minio-upload"
+)
+
+# Content hashes being stored by a worker right now -> that worker's file ID
+_pending_hashes: Dict[str, int] = {}
+
+# Retried files waiting out their backoff before going back in the queue
+_requeue_tasks: set = set()
+
+# Shared HTTP client for webhook calls (keeps the connection to n8n alive)
+_http_client: Optional[httpx.AsyncClient] = None
+
+# Webhook notifications still in flight (strong refs until they finish)
+_webhook_tasks: set = set()
+
+# Characters replaced with '_' in object names (\w keeps Unicode letters/digits)
+_UNSAFE_NAME_RE = re.compile(r'[^\w.-]')
+
+
+class TelegramDownloadStream(io.RawIOBase):
+    """
+    Read-only file object over a Telegram download, for minio put_object.
+    
+    put_object runs in a worker thread and calls read(); each read pulls the
+    next chunk from the event loop, so the download only runs as fast as the
+    upload consumes it and nothing touches the disk. Every chunk is fed to
+    sha256 on the way through.
+    """
+    
+    def __init__(self, chunks: AsyncIterator[bytes], loop: asyncio.AbstractEventLoop):
+        self._chunks = chunks
+        self._loop = loop
+        self._fetch: Optional[asyncio.Future] = None  # chunk being fetched for read()
+        self._chunk = b""
+        self._offset = 0  # bytes of _chunk already returned
+        self._eof = False
+        self.sha256 = hashlib.sha256()
+    
+    def readable(self) -> bool:
+        return True
+    
+    async def _next_chunk(self) -> bytes:
+        # Runs on the loop, so it can't race with abort()
+        if self.closed:
+            raise ValueError("I/O operation on closed stream")
+        self._fetch = asyncio.ensure_future(self._chunks.__anext__())
+        return await self._fetch
+    
+    async def abort(self):
+        """
+        Stop feeding the upload (call on the loop). Cancels any chunk fetch
+        read() is blocked on, so the upload thread fails fast instead of
+        waiting on a download nobody will finish.
+        """
+        self.close()
+        if self._fetch is not None and not self._fetch.done():
+            self._fetch.cancel()
+            await asyncio.gather(self._fetch, return_exceptions=True)
+    
+    def read(self, size: int = -1) -> bytes:
+        if self.closed:
+            raise ValueError("I/O operation on closed stream")
+        
+        if self._offset >= len(self._chunk) and not self._eof:
+            try:
+                chunk = asyncio.run_coroutine_threadsafe(
+                    self._next_chunk(), self._loop
+                ).result()
+            except StopAsyncIteration:
+                self._eof = True
+            except concurrent.futures.CancelledError:
+                raise IOError("Download aborted")
+            else:
+                self.sha256.update(chunk)
+                self._chunk, self._offset = chunk, 0
+        
+        # Slicing by offset never copies the unread remainder, and a read
+        # covering the whole chunk returns the chunk object itself
+        end = len(self._chunk) if size < 0 else min(len(self._chunk), self._offset + size)
+        data = self._chunk[self._offset:end]
+        self._offset = end
+        return data
+
+
+async def iter_download_chunks(
+    telegram_client: TelegramClient,
+    document,
+    parts: int = 1
+) -> AsyncIterator[bytes]:
+    """
+    Yield a document's bytes in order. With parts > 1, keeps up to `parts`
+    one-chunk iter_download requests in flight at their own offsets, so a
+    large file is not limited to one request per round-trip.
+    
+    Every Telethon download iterator is closed when done with, which hands
+    back any sender borrowed for a file stored on another DC.
+    """
+    chunk_size = settings.DOWNLOAD_CHUNK_SIZE
+    
+    if parts <= 1:
+        async with telegram_client.iter_download(
+            document, request_size=chunk_size
+        ) as download:
+            async for chunk in download:
+                yield chunk
+        return
+    
+    offsets = iter(range(0, document.size, chunk_size))
+    
+    async def fetch(offset: int) -> bytes:
+        async with telegram_client.iter_download(
+            document, offset=offset, limit=1, request_size=chunk_size
+        ) as download:
+            async for chunk in download:
+                return chunk
+        return b""
+    
+    pending = deque()
+    try:
+        for offset in offsets:
+            pending.append(asyncio.create_task(fetch(offset)))
+            if len(pending) >= parts:
+                break
+        
+        while pending:
+            chunk = await pending.popleft()
+            offset = next(offsets, None)
+            if offset is not None:
+                pending.append(asyncio.create_task(fetch(offset)))
+            yield chunk
+    finally:
+        # Wait for cancelled fetches so their iterators are closed too
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+def _defer_downloads(seconds: float):
+    """Hold off all download workers for `seconds` after a FloodWait."""
+    global _next_download_time
+    _next_download_time = max(
+        _next_download_time,
+        asyncio.get_running_loop().time() + seconds
+    )
+
+
+def backoff_delay(attempt: int) -> float:
+    """Seconds to wait before retry number `attempt` (exponential, jittered, capped)."""
+    delay = settings.BACKOFF_BASE * (2 ** attempt)
+    delay *= 1 + random.uniform(0, settings.BACKOFF_JITTER)
+    return min(settings.BACKOFF_CAP, delay)
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Get the shared webhook HTTP client, creating it on first use."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=30.0,
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=20)
+        )
+    return _http_client
+
+
+async def close_http_client():
+    """
+    Wait for pending webhook notifications, then close the shared
+    HTTP client (called on shutdown).
+    """
+    global _http_client
+    if _webhook_tasks:
+        await asyncio.gather(*_webhook_tasks, return_exceptions=True)
+    
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
 
 
 async def notify_webhook(payload: WebhookPayload) -> bool:
@@ -46,18 +236,17 @@ async def notify_webhook(payload: WebhookPayload) -> bool:
         return True
     
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                settings.PROCESSING_WEBHOOK_URL,
-                json=payload.model_dump(),
-                headers={"Content-Type": "application/json"}
-            )
-            if response.status_code == 200:
-                logger.info(f"Webhook notification sent for file {payload.file_id}")
-                return True
-            else:
-                logger.warning(f"Webhook returned status {response.status_code}")
-                return False
+        response = await get_http_client().post(
+            settings.PROCESSING_WEBHOOK_URL,
+            json=payload.model_dump(),
+            headers={"Content-Type": "application/json"}
+        )
+        if response.status_code == 200:
+            logger.info(f"Webhook notification sent for file {payload.file_id}")
+            return True
+        else:
+            logger.warning(f"Webhook returned status {response.status_code}")
+            return False
     except Exception as e:
         logger.error(f"Failed to send webhook notification: {e}")
         return False
@@ -67,15 +256,21 @@ async def download_and_upload_file(
     telegram_client: TelegramClient,
     minio_client,
     pool,
-    file_id: int
+    file_id: int,
+    uploaded_event: Optional[asyncio.Event] = None,
+    known_hashes: Optional[set] = None
 ) -> bool:
     """
     Download a file from Telegram and upload to MinIO.
     Returns True on success, False on failure.
+    Sets uploaded_event (if given) once the file is COMPLETED.
+    known_hashes (if given) holds every content hash in the database; the
+    duplicate lookup only goes to the database when the hash is in it.
     """
-    file_data = await get_file_by_id(pool, file_id)
+    # Claim the file (QUEUED -> DOWNLOADING) and load it in one round-trip
+    file_data = await claim_queued_file(pool, file_id)
     if not file_data:
-        logger.error(f"File {file_id} not found in database")
+        logger.warning(f"File {file_id} not found, not queued, or claimed elsewhere")
         return False
     
     # Check if category is assigned
@@ -94,65 +289,73 @@ async def download_and_upload_file(
     file_name = file_data.get('file_name', f"file_{message_id}")
     
     # Create safe filename
-    safe_name = "".join(c if c.isalnum() or c in '.-_' else '_' for c in file_name)
-    local_path = os.path.join(settings.DOWNLOAD_PATH, f"{file_id}_{safe_name}")
+    safe_name = _UNSAFE_NAME_RE.sub('_', file_name)
+    minio_path = f"{channel_id}/{message_id}/{safe_name}"
+    content_hash = None
     
     try:
-        # Update status to DOWNLOADING
-        await update_file_status(pool, file_id, FileStatus.DOWNLOADING)
         logger.info(f"Downloading file {file_id}: {file_name}")
         
-        # Get the channel entity first (required for entity resolution after restart)
-        # Get the channel entity first (required for entity resolution after restart)
-        try:
-            # 1. Try direct ID resolution
-            entity = await telegram_client.get_entity(channel_id)
-        except Exception as e1:
-            logger.warning(f"Direct entity resolution failed for {channel_id}: {e1}")
-            
-            # 2. Try PeerChannel
-            try:
-                from telethon.tl.types import PeerChannel
-                entity = await telegram_client.get_entity(PeerChannel(channel_id))
-            except Exception as e2:
-                logger.warning(f"PeerChannel resolution failed for {channel_id}: {e2}")
-                
-                # 3. Try Username if available
-                username = file_data.get('channel_username')
-                if username:
-                    try:
-                        logger.info(f"Trying resolution by username: {username}")
-                        entity = await telegram_client.get_entity(username)
-                    except Exception as e3:
-                        logger.error(f"Username resolution failed for {username}: {e3}")
-                        raise ValueError(f"Cannot resolve channel {channel_id} (username: {username})")
-                else:
-                    raise ValueError(f"Cannot resolve channel {channel_id} and no username available")
+        # Get the channel entity first (cached; shared with the scanner)
+        entity = await resolve_channel_entity(telegram_client, pool, channel_id)
         
         # Get the message from Telegram using the resolved entity
-        try:
-            message = await telegram_client.get_messages(entity, ids=message_id)
-            if not message or not message.media:
-                raise ValueError("Message not found or has no media")
-        except FloodWaitError as e:
-            logger.warning(f"FloodWait: sleeping {e.seconds}s")
-            await asyncio.sleep(e.seconds)
-            message = await telegram_client.get_messages(entity, ids=message_id)
+        message = await telegram_client.get_messages(entity, ids=message_id)
+        if not message or not message.media:
+            raise ValueError("Message not found or has no media")
+        
+        # Ensure bucket exists (checked once per bucket per process)
+        if bucket not in _known_buckets:
+            if not await asyncio.to_thread(minio_client.bucket_exists, bucket):
+                await asyncio.to_thread(minio_client.make_bucket, bucket)
+            _known_buckets.add(bucket)
         
-        # Download to local temp
-        await telegram_client.download_media(message, local_path)
+        # Stream straight from Telegram into MinIO, hashing on the way
+        file_size = message.document.size
+        parts = 1
+        if file_size > settings.PARALLEL_DOWNLOAD_THRESHOLD:
+            parts = settings.PARALLEL_DOWNLOAD_PARTS
+        chunks = iter_download_chunks(telegram_client, message.document, parts)
+        stream = TelegramDownloadStream(chunks, asyncio.get_running_loop())
         
-        if not os.path.exists(local_path):
-            raise FileNotFoundError(f"Downloaded file not found: {local_path}")
+        upload = asyncio.get_running_loop().run_in_executor(
+            _upload_executor,
+            functools.partial(
+                minio_client.put_object,
+                bucket,
+                minio_path,
+                stream,
+                length=file_size,
+                part_size=settings.UPLOAD_PART_SIZE,
+                content_type=file_data.get('mime_type', 'application/octet-stream')
+            )
+        )
+        try:
+            # Shielded: on cancellation the thread must be stopped, not abandoned
+            await asyncio.shield(upload)
+        finally:
+            # Stop fetching, let the upload thread exit, then close the download
+            await stream.abort()
+            await asyncio.gather(upload, return_exceptions=True)
+            await chunks.aclose()
         
-        # Calculate content hash for deduplication
-        content_hash = await calculate_content_hash(local_path)
+        content_hash = stream.sha256.hexdigest()
         
-        # Check for duplicate
-        existing_id = await check_content_hash_exists(pool, content_hash)
+        # Check for duplicate (the hash itself is always recorded). Claiming
+        # the hash before any await stops two workers both keeping the same
+        # content when neither has reached COMPLETED yet.
+        existing_id = None
+        if settings.ENABLE_CONTENT_DEDUP:
+            existing_id = _pending_hashes.get(content_hash)
+            if existing_id is None:
+                _pending_hashes[content_hash] = file_id
+                if known_hashes is None or content_hash in known_hashes:
+                    existing_id = await check_content_hash_exists(pool, content_hash)
+        if known_hashes is not None:
+            known_hashes.add(content_hash)
         if existing_id and existing_id != file_id:
             logger.warning(f"File {file_id} is duplicate of {existing_id}")
-            os.remove(local_path)
+            await asyncio.to_thread(minio_client.remove_object, bucket, minio_path)
             await update_file_status(
                 pool, file_id, FileStatus.FAILED_PERMANENT,
                 error_message=f"Duplicate of file {existing_id}",
@@ -160,31 +363,6 @@ async def download_and_upload_file(
             )
             return False
         
-        # Update status to UPLOADING
-        await update_file_status(
-            pool, file_id, FileStatus.UPLOADING,
-            content_hash=content_hash
-        )
-        logger.info(f"Uploading file {file_id} to bucket: {bucket}")
-        
-        # Upload to MinIO
-        file_size = os.path.getsize(local_path)
-        minio_path = f"{channel_id}/{message_id}/{safe_name}"
-        
-        # Ensure bucket exists
-        if not minio_client.bucket_exists(bucket):
-            minio_client.make_bucket(bucket)
-        
-        minio_client.fput_object(
-            bucket,
-            minio_path,
-            local_path,
-            content_type=file_data.get('mime_type', 'application/octet-stream')
-        )
-        
-        # Clean up local file
-        os.remove(local_path)
-        
         # Update status to COMPLETED
         full_path = f"{bucket}/{minio_path}"
         await update_file_status(
@@ -194,6 +372,10 @@ async def download_and_upload_file(
         )
         logger.info(f"File {file_id} uploaded successfully to {full_path}")
         
+        # Wake up n8n long-polls waiting for unprocessed files
+        if uploaded_event is not None:
+            uploaded_event.set()
+        
         # Send webhook notification to n8n
         payload = WebhookPayload(
             file_id=file_id,
@@ -208,21 +390,29 @@ async def download_and_upload_file(
             channel_name=file_data.get('channel_name'),
             content_hash=content_hash
         )
-        await notify_webhook(payload)
+        # Best effort; don't hold up the next file waiting for n8n
+        task = asyncio.create_task(notify_webhook(payload))
+        _webhook_tasks.add(task)
+        task.add_done_callback(_webhook_tasks.discard)
         
         return True
         
     except FloodWaitError as e:
+        # Pause every worker; download_worker re-queues this file
         logger.warning(f"FloodWait for file {file_id}: {e.seconds}s")
+        _defer_downloads(e.seconds)
         await update_file_status(
             pool, file_id, FileStatus.QUEUED,
             error_message=f"FloodWait: retry after {e.seconds}s"
         )
-        await asyncio.sleep(e.seconds)
-        return False
+        raise
+        
+    except RECOVERABLE_ERRORS:
+        # Retried by download_worker with backoff
+        raise
         
     except Exception as e:
-        logger.error(f"Failed to process file {file_id}: {e}")
+        logger.error(f"Failed to process file {file_id}: {e}", exc_info=True)
         
         # Increment retry count
         retry_count = await increment_retry_count(pool, file_id)
@@ -240,39 +430,115 @@ async def download_and_upload_file(
                 error_message=str(e)
             )
         
-        # Clean up temp file if exists
-        if os.path.exists(local_path):
-            os.remove(local_path)
-        
         return False
+    
+    finally:
+        if content_hash and _pending_hashes.get(content_hash) == file_id:
+            del _pending_hashes[content_hash]
 
 
-async def recover_queue(pool, download_queue: asyncio.Queue):
+async def enqueue_download(
+    download_queue: asyncio.Queue,
+    in_flight: set,
+    file_id: int
+) -> bool:
+    """
+    Add a file to the download queue unless it is already queued or being
+    processed. Only waits if the queue is full. Returns True if queued.
+    """
+    return await enqueue_downloads(download_queue, in_flight, [file_id]) == 1
+
+
+async def enqueue_downloads(
+    download_queue: asyncio.Queue,
+    in_flight: set,
+    file_ids: List[int]
+) -> int:
+    """
+    Add many files to the download queue in one pass, skipping any already
+    in flight. Only waits if the queue is full. Returns how many were queued.
+    """
+    queued = 0
+    for file_id in file_ids:
+        if file_id in in_flight:
+            logger.debug("File %s already in flight, not queueing again", file_id)
+            continue
+        
+        in_flight.add(file_id)
+        try:
+            download_queue.put_nowait(file_id)
+        except asyncio.QueueFull:
+            await download_queue.put(file_id)
+        queued += 1
+    return queued
+
+
+async def _requeue_later(download_queue: asyncio.Queue, file_id: int, delay: float):
+    if delay > 0:
+        await asyncio.sleep(delay)
+    await download_queue.put(file_id)
+
+
+def _requeue(download_queue: asyncio.Queue, file_id: int, delay: float = 0.0):
+    """
+    Put a file a worker gave up on back in the queue after `delay` seconds.
+    Done from a background task: workers are the only consumers, so a worker
+    waiting for room itself could deadlock them all, and its slot would sit
+    idle through the backoff. The file stays in flight until it is re-queued.
+    """
+    task = asyncio.create_task(_requeue_later(download_queue, file_id, delay))
+    _requeue_tasks.add(task)
+    task.add_done_callback(_requeue_tasks.discard)
+
+
+async def cancel_requeues():
+    """
+    Drop pending re-queues (called on shutdown). Their rows are already
+    QUEUED, so recover_queue picks them up on the next start.
+    """
+    for task in list(_requeue_tasks):
+        task.cancel()
+    await asyncio.gather(*_requeue_tasks, return_exceptions=True)
+
+
+async def recover_queue(pool, download_queue: asyncio.Queue, in_flight: set):
     """
     Recover queued files from database on startup.
-    Called during app lifespan initialization.
+    Runs alongside the download workers: IDs are streamed from the database
+    and queued as they arrive, so downloads start before recovery finishes.
     """
-    # Reset stuck files
-    await reset_downloading_files(pool)
-    
-    # Get queued file IDs
-    queued_ids = await get_queued_file_ids(pool)
+    recovered = 0
+    try:
+        # Reset stuck files
+        await reset_downloading_files(pool)
+        
+        # Queue file IDs batch by batch (waits only if the queue is full)
+        async for file_id in get_queued_file_ids(pool):
+            if await enqueue_download(download_queue, in_flight, file_id):
+                recovered += 1
+    except Exception as e:
+        # Runs as a background task: nobody awaits it until shutdown
+        logger.error(f"Queue recovery failed after {recovered} files: {e}", exc_info=True)
+        return
     
-    if queued_ids:
-        logger.info(f"Recovering {len(queued_ids)} queued files")
-        for file_id in queued_ids:
-            await download_queue.put(file_id)
+    if recovered:
+        logger.info(f"Recovered {recovered} queued files")
 
 
 async def download_worker(
     telegram_client: TelegramClient,
     minio_client,
     pool,
-    download_queue: asyncio.Queue
+    download_queue: asyncio.Queue,
+    in_flight: set,
+    uploaded_event: Optional[asyncio.Event] = None,
+    known_hashes: Optional[set] = None
 ):
     """
     Background worker that processes the download queue.
-    Runs continuously, processing one file at a time.
+    Runs continuously, processing one file at a time; DOWNLOAD_CONCURRENCY
+    workers share the queue to transfer files in parallel.
+    Removes each file from in_flight once it is done with it.
     """
     logger.info("Download worker started")
     
@@ -292,30 +558,55 @@ async def download_worker(
             file_id = await download_queue.get()
             logger.info(f"Processing file {file_id} from queue")
             
+            requeued = False
             try:
+                # Respect any FloodWait reported by an earlier download
+                delay = _next_download_time - asyncio.get_running_loop().time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                
                 await download_and_upload_file(
                     telegram_client,
                     minio_client,
                     pool,
-                    file_id
+                    file_id,
+                    uploaded_event,
+                    known_hashes
                 )
-            except ConnectionError:
-                logger.error(f"Connection lost while processing file {file_id}. Re-queueing.")
-                await download_queue.put(file_id) # Put back in queue
-                await asyncio.sleep(5)
+            except FloodWaitError:
+                _requeue(download_queue, file_id) # Still in flight
+                requeued = True
+            except RECOVERABLE_ERRORS as e:
+                retry_count = await increment_retry_count(pool, file_id)
+                
+                if retry_count >= settings.MAX_RETRY_COUNT:
+                    await update_file_status(
+                        pool, file_id, FileStatus.FAILED_PERMANENT,
+                        error_message=f"Max retries exceeded: {str(e)}"
+                    )
+                    logger.error(f"File {file_id} marked as FAILED_PERMANENT after {retry_count} retries")
+                else:
+                    delay = backoff_delay(retry_count)
+                    logger.warning(f"Transient error on file {file_id}: {e}. Re-queueing in {delay:.1f}s")
+                    await update_file_status(
+                        pool, file_id, FileStatus.QUEUED,
+                        error_message=str(e)
+                    )
+                    _requeue(download_queue, file_id, delay) # Still in flight
+                    requeued = True
             except Exception as e:
-                logger.error(f"Unexpected error processing file {file_id}: {e}")
+                logger.error(f"Unexpected error processing file {file_id}: {e}", exc_info=True)
             finally:
+                if not requeued:
+                    in_flight.discard(file_id)
                 download_queue.task_done()
             
-            # Small delay between files
-            await asyncio.sleep(1)
-            
         except asyncio.CancelledError:
             logger.info("Download worker cancelled")
             break
         except Exception as e:
-            logger.error(f"Download worker error: {e}")
+            logger.error(f"Download worker error: {e}", exc_info=True)
             await asyncio.sleep(5)
     
     logger.info("Download worker stopped")
+